@@ -0,0 +1,4 @@
+USE printapp_dev;
+-- Fails while two users share an Auth0UserId, find them with
+-- SELECT Auth0UserId, COUNT(*) FROM users GROUP BY Auth0UserId HAVING COUNT(*) > 1;
+ALTER TABLE users ADD unique key (Auth0UserId);
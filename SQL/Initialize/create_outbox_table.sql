@@ -0,0 +1,17 @@
+USE printapp_dev;
+CREATE TABLE outbox (
+	JobId INT NOT NULL auto_increment primary key,
+    JobType nvarchar(50) NOT NULL,
+    IdempotencyKey nvarchar(191) NOT NULL,
+    Payload text,
+    Status nvarchar(10) NOT NULL default 'pending',
+    Attempts INT NOT NULL default 0,
+    LastError text,
+    CreatedAt datetime NOT NULL,
+    AvailableAt datetime NOT NULL,
+    LockedBy nvarchar(64),
+    LockedAt datetime,
+    CompletedAt datetime,
+    unique key (IdempotencyKey),
+    key (Status, AvailableAt)
+);
\ No newline at end of file
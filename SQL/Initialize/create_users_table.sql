@@ -2,5 +2,6 @@ use printapp_dev;
 CREATE TABLE users (
 	UserId INT primary key auto_increment NOT NULL,
     UserName nvarchar(50),
-    Auth0UserId nvarchar(100)
+    Auth0UserId nvarchar(100),
+    unique key (Auth0UserId)
 );
\ No newline at end of file
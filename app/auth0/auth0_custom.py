@@ -1,6 +1,9 @@
 from app.configs.auth0_configs import *
 from requests import post, get, patch
 
+# (connect, read) seconds, so a hung Auth0 call can't hold an outbox job lease forever.
+REQUEST_TIMEOUT = (5, 10)
+
 class Auth0UserManager:
     authToken = None
 
@@ -15,7 +18,7 @@ class Auth0UserManager:
             'audience': API_IDENT,
             'grant_type': 'client_credentials'
         }
-        resp = post(AUTH0_DOMAIN + '/oauth/token', json=data, headers=headers)
+        resp = post(AUTH0_DOMAIN + '/oauth/token', json=data, headers=headers, timeout=REQUEST_TIMEOUT)
         resp.raise_for_status()
         self.authToken = resp.json()['access_token']
 
@@ -28,7 +31,7 @@ class Auth0UserManager:
             'app_metadata': {'app_user_id': user_id}
         }
 
-        resp = patch(API_IDENT + 'users/' + auth0_user_id, headers=headers, json=body)
+        resp = patch(API_IDENT + 'users/' + auth0_user_id, headers=headers, json=body, timeout=REQUEST_TIMEOUT)
         resp.raise_for_status()
 
         return resp.json()
\ No newline at end of file
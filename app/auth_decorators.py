@@ -1,6 +1,11 @@
+import logging
 from flask import request, Response
 from functools import wraps
+from math import ceil
 from configs.allowedkeys import Allowed_Keys
+from rate_limiter.rate_limiter import get_limiter
+
+logger = logging.getLogger(__name__)
 
 def required_apikey(f):
     @wraps(f)
@@ -8,8 +13,37 @@ def required_apikey(f):
         apikey = request.headers.get('ApiKey')
         if apikey not in Allowed_Keys:
             return not_authorized()
+
+        try:
+            limiter = get_limiter()
+            retry_after = None
+            if limiter is not None:
+                retry_after = limiter.check(apikey, getattr(f, 'rate_class', None) or method_rate_class())
+        except Exception:
+            # fail open, an unavailable limiter store must not take the API down with it
+            logger.exception('Rate limit check failed, letting the request through')
+            retry_after = None
+
+        if retry_after is not None:
+            return rate_limited(retry_after)
+
         return f(*args, **kwargs)
     return decorated
 
+def rate_class(name):
+    """Puts an endpoint in a rate limit class other than the one implied by its method."""
+    def decorator(f):
+        f.rate_class = name
+        return f
+    return decorator
+
+def method_rate_class():
+    return 'read' if request.method in ('GET', 'HEAD', 'OPTIONS') else 'write'
+
 def not_authorized():
-    return Response('A valid API key is required to access this endpoint.', 403)
\ No newline at end of file
+    return Response('A valid API key is required to access this endpoint.', 403)
+
+def rate_limited(retry_after):
+    seconds = max(1, int(ceil(retry_after)))
+    return Response('Rate limit exceeded. Retry in {0} seconds.'.format(seconds), 429,
+                    {'Retry-After': str(seconds)})
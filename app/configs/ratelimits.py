@@ -0,0 +1,19 @@
+# Token bucket per API key and route class: (burst size, tokens refilled per second).
+# The limits apply per key. While every client shares one key from Allowed_Keys
+# they are a global cap on the whole API, so size them for all clients together.
+Rate_Limits = {
+    'read': (60, 20.0),
+    'write': (20, 5.0),
+    'presign': (10, 0.5)
+}
+
+# Per key overrides of Rate_Limits, e.g. {'partner-key': {'read': (200, 50.0)}}
+Key_Rate_Limits = {}
+
+# 'sqlite' shares counters between the workers of a single host, 'redis' between
+# hosts (needs the redis package), 'memory' only within one process. None turns
+# rate limiting off, which stays the default until clients get their own keys:
+# with one shared key the limits above would cap the whole API.
+Rate_Limit_Backend = None
+Rate_Limit_Sqlite_Path = '/tmp/print3d-ratelimits.sqlite'
+Rate_Limit_Redis_Url = 'redis://localhost:6379/0'
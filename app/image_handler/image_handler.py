@@ -1,5 +1,6 @@
 import boto3
 import botocore
+from botocore.config import Config
 
 from string import ascii_lowercase, ascii_uppercase
 from random import choice
@@ -7,12 +8,15 @@ from time import time
 
 from app.configs.s3_configs import *
 
+# Seconds, so a hung S3 call can't hold a request or an outbox job lease forever.
+S3_TIMEOUTS = Config(connect_timeout=5, read_timeout=10)
+
 class ImageHandler():
 
     def __init__(self):
         self.session = boto3.Session(aws_access_key_id=ACCESS_KEY, aws_secret_access_key=SECRET_KEY)
-        self.client = self.session.client('s3')
-        self.s3 = self.session.resource('s3')
+        self.client = self.session.client('s3', config=S3_TIMEOUTS)
+        self.s3 = self.session.resource('s3', config=S3_TIMEOUTS)
 
     def get_presigned_post(self):
         file_key = ''.join([choice(ascii_uppercase + ascii_lowercase) for x in range(8)])
@@ -0,0 +1,28 @@
+from image_handler.image_handler import ImageHandler
+from auth0.auth0_custom import Auth0UserManager
+
+# Jobs can be delivered more than once, so every handler must be safe to repeat.
+# Each one gets the job's payload and its idempotency key, which stays the same
+# across deliveries and can be handed to services that deduplicate on it.
+
+
+def delete_s3_image(payload, idempotency_key):
+    # Deleting a key that is already gone is a no-op in S3. delete_objects
+    # reports per key failures in the response instead of raising.
+    imgHandler = ImageHandler()
+    resp = imgHandler.delete_file_by_key(payload['FileKey'])
+    if resp.get('Errors'):
+        raise IOError('S3 could not delete {0}: {1}'.format(payload['FileKey'], resp['Errors']))
+
+
+def set_auth0_app_metadata(payload, idempotency_key):
+    # Writes the same metadata every time.
+    auth_manager = Auth0UserManager()
+    auth_manager.get_bearer()
+    auth_manager.set_app_metadata(payload['Auth0UserId'], payload['UserId'])
+
+
+JOB_HANDLERS = {
+    'delete_s3_image': delete_s3_image,
+    'set_auth0_app_metadata': set_auth0_app_metadata
+}
@@ -0,0 +1,171 @@
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import DateTime, Integer, bindparam, text
+from sqlalchemy.exc import IntegrityError
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# A job is due when it is waiting for its next attempt, or when its lease ran
+# out before the worker holding it finished (it died or hung) and attempts are left.
+DUE = ("((Status = :pending AND AvailableAt <= :now) "
+       "OR (Status = :running AND LockedAt < :expired AND Attempts < :max_attempts))")
+
+
+def outbox_class():
+    """The mapped outbox table, looked up on first use.
+
+    printapp_sqlalchemy reflects the database at import, so resolving it here
+    keeps a database without the table (see SQL/Initialize/create_outbox_table.sql)
+    from breaking everything that imports the models.
+    """
+    from printapp_sqlalchemy.printapp_sqlalchemy import Base
+
+    try:
+        return Base.classes.outbox
+    except AttributeError:
+        raise RuntimeError('The outbox table is missing, create it with '
+                           'SQL/Initialize/create_outbox_table.sql.')
+
+
+def _execute(bind, statement, params, **columns):
+    clause = text(statement).bindparams(
+        *[bindparam(name, type_=DateTime) for name, value in params.items() if isinstance(value, datetime)])
+    if columns:
+        clause = clause.columns(**columns)
+    return bind.execute(clause, params)
+
+
+def _find_job(session, idempotency_key, for_update=False):
+    Outbox = outbox_class()
+    query = session.query(Outbox).filter(Outbox.IdempotencyKey == idempotency_key)
+    return (query.with_for_update() if for_update else query).first()
+
+
+def enqueue(session, job_type, payload, idempotency_key):
+    """Add a job to the outbox as part of the session's current transaction.
+
+    The job only becomes visible to the workers when the caller commits, and
+    is dropped with everything else if the transaction rolls back. Queueing a
+    key that is already pending, running or done is a no-op and returns the
+    existing job. A key whose job failed is queued again with the new payload
+    and a fresh set of attempts.
+    """
+    existing = _find_job(session, idempotency_key)
+    if existing is None:
+        now = datetime.utcnow()
+
+        job = outbox_class()()
+        job.JobType = job_type
+        job.IdempotencyKey = idempotency_key
+        job.Payload = json.dumps(payload)
+        job.Status = PENDING
+        job.Attempts = 0
+        job.CreatedAt = now
+        job.AvailableAt = now
+
+        try:
+            with session.begin_nested():
+                session.add(job)
+            return job
+        except IntegrityError:
+            # Another request queued the same key since the check above. The
+            # locking read sees its row even under MySQL's repeatable read.
+            existing = _find_job(session, idempotency_key, for_update=True)
+
+    if existing.Status == FAILED:
+        existing.JobType = job_type
+        existing.Payload = json.dumps(payload)
+        existing.Status = PENDING
+        existing.Attempts = 0
+        existing.AvailableAt = datetime.utcnow()
+        existing.LockedBy = None
+    return existing
+
+
+def claim(conn, token, batch_size, lease_seconds, max_attempts):
+    """Lock up to batch_size due jobs for one worker and return them.
+
+    Jobs still running after lease_seconds are assumed to belong to a worker
+    that died and are handed out again, so delivery is at least once. Jobs
+    that used up max_attempts that way are marked failed instead.
+    """
+    now = datetime.utcnow()
+    params = {'pending': PENDING, 'running': RUNNING, 'failed': FAILED, 'now': now,
+              'expired': now - timedelta(seconds=lease_seconds), 'max_attempts': max_attempts,
+              'token': token}
+
+    _execute(conn, "UPDATE outbox SET Status = :failed, LockedBy = NULL, "
+                   "LastError = 'Lease expired on the last attempt, the job may be crashing its worker.' "
+                   "WHERE Status = :running AND LockedAt < :expired AND Attempts >= :max_attempts",
+             dict((k, params[k]) for k in ('failed', 'running', 'expired', 'max_attempts')))
+
+    candidates = _execute(conn, "SELECT JobId FROM outbox WHERE " + DUE + " ORDER BY JobId LIMIT :batch_size",
+                          dict(params, batch_size=batch_size), JobId=Integer).fetchall()
+    if not candidates:
+        return []
+
+    # DUE is checked again, so a job another worker claimed in the meantime is skipped.
+    ids = dict(('id{0}'.format(i), row.JobId) for i, row in enumerate(candidates))
+    _execute(conn, "UPDATE outbox "
+                   "SET Status = :running, LockedBy = :token, LockedAt = :now, Attempts = Attempts + 1 "
+                   "WHERE JobId IN (" + ', '.join(':' + name for name in sorted(ids)) + ") AND " + DUE,
+             dict(params, **ids))
+
+    return _execute(conn, "SELECT JobId, JobType, IdempotencyKey, Payload, Attempts "
+                          "FROM outbox WHERE LockedBy = :token AND Status = :running ORDER BY JobId",
+                    {'token': token, 'running': RUNNING}).fetchall()
+
+
+def complete(conn, job_id, token):
+    _execute(conn, "UPDATE outbox SET Status = :done, CompletedAt = :now, LockedBy = NULL "
+                   "WHERE JobId = :job_id AND LockedBy = :token",
+             {'done': DONE, 'now': datetime.utcnow(), 'job_id': job_id, 'token': token})
+
+
+def fail(conn, job_id, token, attempts, error, max_attempts):
+    """Schedule a retry with exponential backoff, or give up after max_attempts."""
+    now = datetime.utcnow()
+    status = FAILED if attempts >= max_attempts else PENDING
+    _execute(conn, "UPDATE outbox SET Status = :status, AvailableAt = :available, LastError = :error, "
+                   "LockedBy = NULL WHERE JobId = :job_id AND LockedBy = :token",
+             {'status': status, 'available': now + timedelta(seconds=min(300, 2 ** attempts)),
+              'error': error[:2000], 'job_id': job_id, 'token': token})
+    return status
+
+
+def purge_completed(conn, older_than_days):
+    _execute(conn, "DELETE FROM outbox WHERE Status = :done AND CompletedAt < :before",
+             {'done': DONE, 'before': datetime.utcnow() - timedelta(days=older_than_days)})
+
+
+def queue_metrics(bind):
+    """Queue depth by status, and how far behind the workers are.
+
+    Pending jobs are split into due ones and ones waiting out a retry backoff
+    (retrying). lag_seconds is how long the oldest due job has been due, so a
+    job that is only waiting for its next attempt doesn't count as lag.
+
+    bind can be a connection or a session.
+    """
+    now = datetime.utcnow()
+    rows = _execute(bind, "SELECT Status, CASE WHEN Status = :pending AND AvailableAt > :now THEN 1 ELSE 0 END "
+                          "AS Waiting, COUNT(*) AS Jobs, MIN(AvailableAt) AS Oldest FROM outbox "
+                          "WHERE Status <> :done GROUP BY Status, Waiting",
+                    {'pending': PENDING, 'done': DONE, 'now': now},
+                    Waiting=Integer, Jobs=Integer, Oldest=DateTime).fetchall()
+
+    metrics = {PENDING: 0, 'due': 0, 'retrying': 0, RUNNING: 0, FAILED: 0, 'lag_seconds': 0.0}
+    for row in rows:
+        metrics[row.Status] += row.Jobs
+        if row.Status == PENDING and row.Waiting:
+            metrics['retrying'] = row.Jobs
+        elif row.Status == PENDING:
+            metrics['due'] = row.Jobs
+            if row.Oldest is not None:
+                metrics['lag_seconds'] = max(0.0, (now - row.Oldest).total_seconds())
+    metrics['depth'] = metrics[PENDING] + metrics[RUNNING]
+    return metrics
@@ -0,0 +1,128 @@
+"""Worker processes that drain the outbox table.
+
+    cd app && PYTHONPATH=.. python -m jobs.worker --processes 4
+
+Each process claims due jobs one at a time, runs its handler and marks it
+done, or schedules a retry with backoff when the handler raises. Every job is
+claimed under its own lease, so --lease only has to outlast a single handler
+call, which the S3 and Auth0 timeouts keep well under the default. The parent
+process logs queue depth and lag every --metrics-interval seconds.
+
+The outbox table has to exist first, see SQL/Initialize/create_outbox_table.sql.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import traceback
+from uuid import uuid4
+
+from sqlalchemy import create_engine
+
+logger = logging.getLogger('jobs.worker')
+
+
+def process_batch(conn, handlers, worker_name, batch_size, lease_seconds, max_attempts):
+    """Run up to batch_size due jobs. Returns the number of jobs claimed.
+
+    Jobs are claimed one per lease as they are run, not all up front, so a
+    job's lease starts when its handler does rather than when the batch did.
+    """
+    from jobs.outbox import claim, complete, fail
+
+    for claimed in range(batch_size):
+        token = '{0}:{1}'.format(worker_name, uuid4().hex[:16])
+        jobs = claim(conn, token, 1, lease_seconds, max_attempts)
+        if not jobs:
+            return claimed
+
+        job = jobs[0]
+        handler = handlers.get(job.JobType)
+        try:
+            if handler is None:
+                raise KeyError('No handler for job type ' + job.JobType)
+            handler(json.loads(job.Payload), job.IdempotencyKey)
+        except Exception:
+            status = fail(conn, job.JobId, token, job.Attempts, traceback.format_exc(), max_attempts)
+            logger.warning('job %s (%s) attempt %s failed, now %s', job.JobId, job.IdempotencyKey,
+                           job.Attempts, status)
+        else:
+            complete(conn, job.JobId, token)
+
+    return batch_size
+
+
+def run_worker(worker_name, options, stop):
+    # Ctrl-C reaches the whole process group, let the parent decide when to stop.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from printapp_sqlalchemy.printapp_sqlalchemy import connectionUri
+    from jobs.handlers import JOB_HANDLERS
+
+    # Connections inherited from the parent can't be shared after the fork.
+    engine = create_engine(connectionUri, pool_size=1, pool_recycle=3600)
+    while not stop.is_set():
+        try:
+            with engine.connect() as conn:
+                claimed = process_batch(conn, JOB_HANDLERS, worker_name, options.batch_size,
+                                        options.lease, options.max_attempts)
+        except Exception:
+            logger.exception('%s could not process a batch', worker_name)
+            claimed = 0
+
+        if claimed < options.batch_size:
+            stop.wait(options.poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run outbox worker processes.')
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--batch-size', type=int, default=20,
+                        help='Jobs a worker runs back to back before polling again.')
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help='Seconds a worker sleeps when the queue is empty.')
+    parser.add_argument('--lease', type=int, default=300,
+                        help='Seconds a worker holds one job before it is handed out again.')
+    parser.add_argument('--max-attempts', type=int, default=8)
+    parser.add_argument('--retention-days', type=int, default=7,
+                        help='Completed jobs, and their idempotency keys, are kept this long.')
+    parser.add_argument('--metrics-interval', type=float, default=30.0)
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(levelname)s %(message)s')
+
+    stop = multiprocessing.Event()
+    host = '{0}-{1}'.format(socket.gethostname(), os.getpid())
+    workers = [multiprocessing.Process(target=run_worker, name='worker-{0}'.format(i),
+                                       args=('{0}-{1}'.format(host, i), options, stop))
+               for i in range(options.processes)]
+    for w in workers:
+        w.start()
+
+    def shutdown(signum, frame):
+        stop.set()
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    from printapp_sqlalchemy.printapp_sqlalchemy import connectionUri
+    from jobs.outbox import queue_metrics, purge_completed
+
+    engine = create_engine(connectionUri, pool_size=1, pool_recycle=3600)
+    while not stop.is_set():
+        try:
+            with engine.connect() as conn:
+                logger.info('outbox %s', json.dumps(queue_metrics(conn), sort_keys=True))
+                purge_completed(conn, options.retention_days)
+        except Exception:
+            logger.exception('could not read outbox metrics')
+        stop.wait(options.metrics_interval)
+
+    for w in workers:
+        w.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@ from flask import Flask, request
 from flask_restplus import Resource, Api, fields
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from sqlalchemy.exc import IntegrityError
 
 from printapp_sqlalchemy.printapp_sqlalchemy import (Filament,
                                                      ColorFamily,
@@ -10,11 +11,11 @@ from printapp_sqlalchemy.printapp_sqlalchemy import (Filament,
                                                      connectionUri,
                                                      Image, User
                                                      )
-from auth_decorators import required_apikey
+from auth_decorators import required_apikey, rate_class
 from image_handler.image_handler import ImageHandler
 
 from helpers.helper_methods import *
-from auth0.auth0_custom import Auth0UserManager
+from jobs.outbox import enqueue, queue_metrics
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = connectionUri
@@ -482,7 +483,8 @@ class PrintCreateResp(Resource):
             prnt.Success = data['Success']
 
         db.session.add(prnt)
-        db.session.commit()
+        # flush so the filament and printer load, the counters go out in the same commit
+        db.session.flush()
 
         filament = prnt.filaments
         filament.LengthRemain = remove_quantity(prnt.LengthUsed, filament.LengthRemain)
@@ -499,6 +501,7 @@ class PrintCreateResp(Resource):
 @api.route('/images/imagerequest')
 class ImageRequestResp(Resource):
     @required_apikey
+    @rate_class('presign')
     def get(self):
         imgHandler = ImageHandler()
         presigned = imgHandler.get_presigned_post()
@@ -524,46 +527,60 @@ class ImageRequestResp(Resource):
             return None, 404
 
         img = entity.images
-        imgHandler = ImageHandler()
 
-        err = None
         if img is not None:
-            try:
-                delete_resp = imgHandler.delete_file_by_key(img.ImagePath[img.ImagePath.rfind('/')+1:])
-            except:
-                err = 'Error deleting image from S3'
+            # the old file is removed from S3 by a job worker once this commits
+            if img.ImagePath != data["ImageUrl"]:
+                file_key = img.ImagePath[img.ImagePath.rfind('/')+1:]
+                enqueue(db.session, 'delete_s3_image', {'FileKey': file_key},
+                        'delete_s3_image:{0}:{1}'.format(img.ImageId, file_key))
         else:
             img = Image()
             img.PrintId = data['PrintId']
             img.PrinterId = data['PrinterId']
+            entity.images = img
+            db.session.add(entity)
 
         img.ImagePath = data["ImageUrl"]
         db.session.add(img)
         db.session.commit()
 
-        if entity.images is None:
-            entity.images = img
-            db.session.add(entity)
-            db.session.commit()
-
-        return {'data':'Image path updated', 'errors':err}, 200
+        return {'data':'Image path updated', 'errors':None}, 200
 
 @api.route('/users/create')
 class UserCreateResp(Resource):
     def post(self):
         data = request.get_json()
 
-        user = User()
-        user.Auth0UserId = data['auth0UserId']
+        # a retried request gets the user it already created, and its queued job
+        existing = db.session.query(User).filter(User.Auth0UserId == data['auth0UserId'])
+        user = existing.first()
+        if user is None:
+            user = User()
+            user.Auth0UserId = data['auth0UserId']
 
-        db.session.add(user)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(user)
+            except IntegrityError:
+                # a concurrent request created the user since the lookup
+                user = existing.with_for_update().one()
+
+        # app_metadata is written to Auth0 by a job worker once this commits
+        enqueue(db.session, 'set_auth0_app_metadata',
+                {'Auth0UserId': data['auth0UserId'], 'UserId': user.UserId},
+                'set_auth0_app_metadata:{0}:{1}'.format(data['auth0UserId'], user.UserId))
         db.session.commit()
 
-        auth_manager = Auth0UserManager()
-        auth_manager.get_bearer()
-        profile = auth_manager.set_app_metadata(data['auth0UserId'],user.UserId)
-
+        # Auth0 is only updated later, so this is not the full profile it used to return
+        profile = {'user_id': data['auth0UserId'], 'app_metadata': {'app_user_id': user.UserId}}
         return {'data': profile }
 
+@api.route('/jobs/metrics')
+class JobMetricsResp(Resource):
+    @required_apikey
+    def get(self):
+        return {'data': queue_metrics(db.session)}
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', debug=True, ssl_context=('./certs/server.crt', './certs/server.key'))
\ No newline at end of file
@@ -0,0 +1,179 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def refill(tokens, updated, capacity, rate, now):
+    """Take one token from a bucket. Returns (allowed, tokens left, seconds until the next token)."""
+    tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return True, tokens - 1, 0.0
+    return False, tokens, (1 - tokens) / rate
+
+
+def validate_limit(name, limit):
+    capacity, rate = limit
+    if capacity < 1 or rate <= 0:
+        raise ValueError('Rate limit {0} needs a burst size of at least 1 and a positive refill rate, '
+                         'got {1!r}'.format(name, limit))
+
+
+class MemoryBackend(object):
+    """Buckets in a dict. Only shared between the threads of one process."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        with self.lock:
+            now = time.time()
+            tokens, updated = self.buckets.get(key, (capacity, now))
+            allowed, tokens, retry_after = refill(tokens, updated, capacity, rate, now)
+            self.buckets[key] = (tokens, now)
+        return allowed, retry_after
+
+
+class SqliteBackend(object):
+    """Buckets in a SQLite file, shared between all worker processes on a host.
+
+    The counters are disposable, so the database runs with synchronous=OFF and
+    an update never waits on an fsync. A bucket locked by another process for
+    longer than busy_timeout seconds raises instead of stalling the request.
+    """
+
+    def __init__(self, path, busy_timeout=0.005):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.local = threading.local()
+
+    def _connection(self):
+        # Connections must not cross a fork or be shared between threads.
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets '
+                         '(BucketKey TEXT PRIMARY KEY, Tokens REAL, Updated REAL) WITHOUT ROWID')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def take(self, key, capacity, rate):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = conn.execute('SELECT Tokens, Updated FROM buckets WHERE BucketKey = ?', (key,)).fetchone()
+            tokens, updated = row if row is not None else (capacity, now)
+            allowed, tokens, retry_after = refill(tokens, updated, capacity, rate, now)
+            conn.execute('INSERT OR REPLACE INTO buckets (BucketKey, Tokens, Updated) VALUES (?, ?, ?)',
+                         (key, tokens, now))
+        except:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return allowed, retry_after
+
+
+class RedisBackend(object):
+    """Buckets in Redis hashes, shared between hosts. The update runs as one Lua script."""
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HMSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring((1 - tokens) / rate)}
+    """
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.StrictRedis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    def take(self, key, capacity, rate):
+        allowed, retry_after = self.script(keys=['ratelimit:' + key], args=[capacity, rate, time.time()])
+        if allowed:
+            return True, 0.0
+        return False, float(retry_after)
+
+
+class RateLimiter(object):
+
+    def __init__(self, backend, limits, key_limits=None):
+        self.backend = backend
+        self.limits = limits
+        self.key_limits = key_limits or {}
+
+        for name, limit in limits.items():
+            validate_limit(name, limit)
+        for apikey, overrides in self.key_limits.items():
+            for name, limit in overrides.items():
+                validate_limit(name, limit)
+
+    def check(self, apikey, rate_class):
+        """Returns None if the request may proceed, otherwise the seconds to wait."""
+        limit = self.key_limits.get(apikey, {}).get(rate_class) or self.limits.get(rate_class)
+        if limit is None:
+            return None
+
+        capacity, rate = limit
+        allowed, retry_after = self.backend.take(apikey + ':' + rate_class, capacity, rate)
+        return None if allowed else retry_after
+
+
+def limiter_from_config():
+    from configs.ratelimits import (Rate_Limits, Key_Rate_Limits, Rate_Limit_Backend,
+                                    Rate_Limit_Sqlite_Path, Rate_Limit_Redis_Url)
+
+    if Rate_Limit_Backend is None:
+        return None
+    elif Rate_Limit_Backend == 'memory':
+        backend = MemoryBackend()
+    elif Rate_Limit_Backend == 'sqlite':
+        backend = SqliteBackend(Rate_Limit_Sqlite_Path)
+    elif Rate_Limit_Backend == 'redis':
+        backend = RedisBackend(Rate_Limit_Redis_Url)
+    else:
+        raise ValueError('Unknown rate limit backend ' + Rate_Limit_Backend)
+
+    return RateLimiter(backend, Rate_Limits, Key_Rate_Limits)
+
+
+_NOT_CONFIGURED = object()
+_limiter = _NOT_CONFIGURED
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is _NOT_CONFIGURED:
+        try:
+            _limiter = limiter_from_config()
+        except Exception:
+            # Logged once, not on every request, and the API keeps serving unlimited.
+            logger.exception('Could not set up rate limiting from configs/ratelimits.py, it is disabled')
+            _limiter = None
+    return _limiter
+
+
+def set_limiter(limiter):
+    """Replace the configured limiter, None disables rate limiting."""
+    global _limiter
+    _limiter = limiter
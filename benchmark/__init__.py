@@ -0,0 +1,11 @@
+import os
+import sys
+
+# main.py and its helpers are imported the same way app/run.py does it, with
+# app/ on the path, so make both the repo root and app/ importable here.
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT_DIR, 'app')
+
+for path in (APP_DIR, ROOT_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,141 @@
+"""Per-request overhead of the API key rate limiter.
+
+Times a no-op view wrapped in required_apikey inside a Flask request context,
+first with rate limiting off and then against each backend, and reports how
+much each backend adds per request. With --processes N the same bucket is
+hammered from N processes at once, as it would be by N gunicorn workers.
+
+Exits non-zero when a backend's mean overhead goes over --budget-us, 100us by
+default. Checks that failed open (a bucket locked for longer than the SQLite
+busy timeout, Redis unreachable) are counted separately, since they skip the
+limiter rather than cost time.
+
+    python -m benchmark.bench_ratelimit
+    python -m benchmark.bench_ratelimit --processes 4 --redis-url redis://localhost:6379/0
+"""
+from __future__ import print_function, division
+
+import argparse
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import benchmark  # noqa: F401 (sets up sys.path)
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# Large enough that no request is refused, a refusal costs the same anyway.
+LIMITS = {'read': (10 ** 9, 10.0 ** 9), 'write': (10 ** 9, 10.0 ** 9), 'presign': (10 ** 9, 10.0 ** 9)}
+
+
+def make_limiter(backend, arg):
+    from rate_limiter.rate_limiter import RateLimiter, MemoryBackend, SqliteBackend, RedisBackend
+
+    if backend == 'off':
+        return None
+    elif backend == 'memory':
+        return RateLimiter(MemoryBackend(), LIMITS)
+    elif backend == 'sqlite':
+        return RateLimiter(SqliteBackend(arg), LIMITS)
+    elif backend == 'redis':
+        return RateLimiter(RedisBackend(arg), LIMITS)
+
+
+class FailOpenCounter(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def measure(args):
+    backend, arg, iterations = args
+
+    from flask import Flask
+    from auth_decorators import required_apikey
+    from configs.allowedkeys import Allowed_Keys
+    from rate_limiter.rate_limiter import set_limiter
+
+    set_limiter(make_limiter(backend, arg))
+    view = required_apikey(lambda: None)
+
+    failed_open = FailOpenCounter()
+    decorator_logger = logging.getLogger('auth_decorators')
+    decorator_logger.addHandler(failed_open)
+    decorator_logger.propagate = False
+
+    app = Flask(__name__)
+    samples = []
+    with app.test_request_context('/prints/1', headers={'ApiKey': Allowed_Keys[0]}):
+        for _ in range(iterations // 10):
+            view()
+        for _ in range(iterations):
+            started = timer()
+            view()
+            samples.append(timer() - started)
+    return samples, failed_open.count
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    n = len(samples)
+    return {
+        'mean': sum(samples) / n * 1e6,
+        'p50': samples[n // 2] * 1e6,
+        'p99': samples[min(n - 1, int(n * 0.99))] * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure rate limiter overhead per request.')
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--redis-url', help='Also measure the Redis backend against this server.')
+    parser.add_argument('--budget-us', type=float, default=100.0,
+                        help='Allowed mean overhead per request in microseconds.')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='print3d-ratelimit-')
+    backends = [('off', None), ('memory', None), ('sqlite', os.path.join(tmp_dir, 'buckets.sqlite'))]
+    if args.redis_url:
+        backends.append(('redis', args.redis_url))
+
+    pool = multiprocessing.Pool(args.processes) if args.processes > 1 else None
+    try:
+        print('{0:<8} {1:>10} {2:>10} {3:>10} {4:>14} {5:>12}'.format(
+            'backend', 'mean us', 'p50 us', 'p99 us', 'overhead us', 'failed open'))
+        baseline = None
+        over_budget = []
+        for backend, arg in backends:
+            job = (backend, arg, args.iterations)
+            results = pool.map(measure, [job] * args.processes) if pool is not None else [measure(job)]
+            samples = [s for chunk, _ in results for s in chunk]
+            failed_open = sum(n for _, n in results)
+
+            stats = summarize(samples)
+            if baseline is None:
+                baseline = stats['mean']
+            overhead = stats['mean'] - baseline
+            if overhead > args.budget_us:
+                over_budget.append(backend)
+            print('{0:<8} {1:>10.1f} {2:>10.1f} {3:>10.1f} {4:>14.1f} {5:>12}'.format(
+                backend, stats['mean'], stats['p50'], stats['p99'], overhead, failed_open))
+    finally:
+        if pool is not None:
+            pool.close()
+        shutil.rmtree(tmp_dir)
+
+    if over_budget:
+        print('Over the {0:.0f}us budget: {1}'.format(args.budget_us, ', '.join(over_budget)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
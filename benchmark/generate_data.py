@@ -0,0 +1,324 @@
+"""Seeded synthetic data generator for the print3d database.
+
+Produces users, printers, filaments, prints and images at a configurable
+scale. Rows are streamed to CSV files and bulk loaded with LOAD DATA LOCAL
+INFILE, so multi-million print datasets load in minutes rather than hours.
+
+    python -m benchmark.generate_data --scale large --reset
+    python -m benchmark.generate_data --users 5000 --prints 2000000 --seed 7
+    python -m benchmark.generate_data --scale small --csv-dir /tmp/seed --no-load
+"""
+from __future__ import print_function, division
+
+import argparse
+import csv
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import date, timedelta
+from string import ascii_lowercase, ascii_uppercase
+
+import benchmark  # noqa: F401 (sets up sys.path)
+
+SCALES = {
+    # name: (users, prints)
+    'small': (50, 5000),
+    'medium': (1000, 100000),
+    'large': (10000, 1000000),
+    'xlarge': (50000, 5000000),
+}
+
+# Matches the seed data in SQL/Initialize/initialize_test_database.sql.
+COLOR_FAMILIES = ['Red', 'Orange', 'Yellow', 'Green', 'Blue', 'Purple', 'White', 'Black']
+
+HTML_COLORS = {
+    'Red': '#d32f2f', 'Orange': '#f47442', 'Yellow': '#fbc02d', 'Green': '#388e3c',
+    'Blue': '#1976d2', 'Purple': '#7b1fa2', 'White': '#ffffff', 'Black': '#000000',
+}
+
+PRINTER_MODELS = ['Maker Select', 'LulzBot Mini', 'Wanhao D7', 'Prusa i3 MK2', 'Ultimaker 2+',
+                  'Creality CR-10', 'Monoprice Mini', 'FlashForge Creator Pro', 'Anet A8']
+PRINTER_SOURCES = ['Newegg', 'Amazon', 'Wanhao', 'Microcenter', 'eBay', 'Kickstarter']
+
+MATERIALS = ['PLA', 'PLA', 'PLA', 'PETG', 'PETG', 'ABS', 'TPU', 'Nylon']
+BRANDS = ['Monoprice', 'Inland', 'Hatchbox', 'eSun', 'Prusament', 'Polymaker', 'Sunlu']
+FILAMENT_SOURCES = ['Monoprice', 'Microcenter', 'Amazon', 'eBay', 'Direct']
+
+PRINT_NAMES = ['3D Benchy', 'Calibration Cube', 'Ninja Stars', 'Phone Stand', 'Cable Clip',
+               'Raspberry Pi Case', 'Spool Holder', 'Fidget Spinner', 'Planter', 'Gear Set',
+               'Filament Guide', 'Headphone Hook', 'Articulated Dragon', 'Vase', 'Low Poly Pikachu']
+
+IMAGE_URL = 'https://print3d-images.s3.amazonaws.com/{0}'
+THING_URL = 'http://www.thingiverse.com/thing:{0}'
+
+START_DATE = date(2015, 1, 1)
+DATE_SPAN_DAYS = 365 * 3
+
+# Load order respects the foreign keys in SQL/Initialize.
+TABLE_COLUMNS = [
+    ('colorfamilies', ['ColorFamilyId', 'ColorFamilyName']),
+    ('users', ['UserId', 'UserName', 'Auth0UserId']),
+    ('images', ['ImageId', 'ImagePath']),
+    ('printers', ['PrinterId', 'UserPrinterId', 'UserId', 'PrinterName', 'DateAcquired',
+                  'NumberOfPrints', 'PrintTimeHours', 'PrinterSource', 'BeltMaintInt',
+                  'BeltMaintLast', 'WireMaintInt', 'WireMaintLast', 'LubeMaintInt',
+                  'LubeMaintLast', 'MainPrinterImageId']),
+    ('filaments', ['FilamentId', 'UserId', 'UserFilamentId', 'Material', 'Brand',
+                   'ColorFamilyId', 'HtmlColor', 'LengthRemain', 'DateAcquired',
+                   'FilamentSource']),
+    ('prints', ['PrintId', 'UserId', 'PrinterId', 'FilamentId', 'MainPrintImageId',
+                'PrintName', 'SourceUrl', 'Success', 'PrintTimeHours', 'PrintTimeMinutes',
+                'PrintDate', 'ModelFileUrl', 'LengthUsed']),
+]
+
+# Tables that reference the generated ids but are not generated themselves.
+# --reset empties them too, so workers never act on jobs for rows that are gone.
+DEPENDENT_TABLES = ['outbox']
+
+# LOAD DATA stores text into BIT columns byte-for-byte, so these go through a
+# user variable and get cast on the way in.
+BIT_COLUMNS = {'prints': ['Success']}
+
+# MySQL's LOAD DATA reads \N as NULL.
+NULL = '\\N'
+
+
+class DataGenerator(object):
+
+    def __init__(self, users, prints, seed=42, printers_per_user=2.0, filaments_per_user=6.0,
+                 print_image_ratio=0.6, printer_image_ratio=0.8):
+        self.users = users
+        self.prints = prints
+        self.seed = seed
+        self.printers_per_user = printers_per_user
+        self.filaments_per_user = filaments_per_user
+        self.print_image_ratio = print_image_ratio
+        self.printer_image_ratio = printer_image_ratio
+
+        self.rng = random.Random(seed)
+        self.next_image_id = 1
+        self.counts = {}
+
+    def write_csvs(self, out_dir):
+        """Write one CSV per table into out_dir and return {table: path}."""
+        writers = {}
+        files = {}
+        paths = {}
+        for table, _ in TABLE_COLUMNS:
+            paths[table] = os.path.join(out_dir, table + '.csv')
+            files[table] = open(paths[table], 'w')
+            writers[table] = csv.writer(files[table], lineterminator='\n')
+            self.counts[table] = 0
+
+        try:
+            self._generate(writers)
+        finally:
+            for f in files.values():
+                f.close()
+
+        return paths
+
+    def _write(self, writers, table, row):
+        writers[table].writerow([NULL if v is None else v for v in row])
+        self.counts[table] += 1
+
+    def _new_image(self, writers):
+        image_id = self.next_image_id
+        self.next_image_id += 1
+        key = ''.join(self.rng.choice(ascii_uppercase + ascii_lowercase) for _ in range(8))
+        self._write(writers, 'images', (image_id, IMAGE_URL.format(key)))
+        return image_id
+
+    def _random_date(self, after=None):
+        start = after or START_DATE
+        span = max(1, DATE_SPAN_DAYS - (start - START_DATE).days)
+        return start + timedelta(days=self.rng.randrange(span))
+
+    def _new_filament(self, filament_id, user_filament_id):
+        color_id = self.rng.randrange(len(COLOR_FAMILIES)) + 1
+        return {
+            'FilamentId': filament_id,
+            'UserFilamentId': user_filament_id,
+            'ColorFamilyId': color_id,
+            'HtmlColor': HTML_COLORS[COLOR_FAMILIES[color_id - 1]],
+            'LengthRemain': self.rng.choice([330, 335, 400]),
+            'DateAcquired': self._random_date(),
+        }
+
+    def _prints_per_user(self):
+        # Heavy-tailed: most users log a handful of prints, a few log thousands.
+        weights = [self.rng.paretovariate(1.2) for _ in range(self.users)]
+        total = sum(weights)
+        allocation = [int(self.prints * w / total) for w in weights]
+        for i in range(self.prints - sum(allocation)):
+            allocation[i % self.users] += 1
+        return allocation
+
+    def _generate(self, writers):
+        rng = self.rng
+
+        for color_id, name in enumerate(COLOR_FAMILIES, 1):
+            self._write(writers, 'colorfamilies', (color_id, name))
+
+        printer_id = 0
+        filament_id = 0
+        print_id = 0
+
+        for user_index, n_prints in enumerate(self._prints_per_user()):
+            user_id = user_index + 1
+            self._write(writers, 'users', (user_id, 'user{0}'.format(user_id),
+                                           'auth0|bench{0:016d}'.format(user_id)))
+
+            n_printers = max(1, int(rng.expovariate(1.0 / self.printers_per_user)) + 1)
+            n_filaments = max(1, int(rng.expovariate(1.0 / self.filaments_per_user)) + 1)
+
+            printers = []
+            for user_printer_id in range(1, n_printers + 1):
+                printer_id += 1
+                printers.append({
+                    'PrinterId': printer_id,
+                    'UserPrinterId': user_printer_id,
+                    'PrinterName': rng.choice(PRINTER_MODELS),
+                    'DateAcquired': self._random_date(),
+                    'NumberOfPrints': 0,
+                    'PrintMinutes': 0,
+                })
+
+            filaments = [self._new_filament(filament_id + i + 1, i + 1) for i in range(n_filaments)]
+            filament_id += n_filaments
+            spools = list(filaments)
+
+            for _ in range(n_prints):
+                print_id += 1
+                printer = rng.choice(printers)
+                minutes = int(rng.lognormvariate(5.0, 0.8)) + 5
+                length = max(1, minutes // 25)
+
+                index = rng.randrange(len(spools))
+                filament = spools[index]
+                if filament['LengthRemain'] < length:
+                    # Spool ran out, the user opens a new one in its place.
+                    filament_id += 1
+                    filament = self._new_filament(filament_id, len(filaments) + 1)
+                    filaments.append(filament)
+                    spools[index] = filament
+
+                image_id = self._new_image(writers) if rng.random() < self.print_image_ratio else None
+
+                printer['NumberOfPrints'] += 1
+                printer['PrintMinutes'] += minutes
+                filament['LengthRemain'] -= length
+
+                self._write(writers, 'prints', (
+                    print_id, user_id, printer['PrinterId'], filament['FilamentId'], image_id,
+                    rng.choice(PRINT_NAMES), THING_URL.format(rng.randrange(1, 2500000)),
+                    1 if rng.random() < 0.85 else 0, minutes // 60, minutes,
+                    self._random_date(printer['DateAcquired']), None, length))
+
+            for printer in printers:
+                hours = printer['PrintMinutes'] // 60
+                image_id = self._new_image(writers) if rng.random() < self.printer_image_ratio else None
+                self._write(writers, 'printers', (
+                    printer['PrinterId'], printer['UserPrinterId'], user_id, printer['PrinterName'],
+                    printer['DateAcquired'], printer['NumberOfPrints'], hours,
+                    rng.choice(PRINTER_SOURCES), 100, rng.randrange(0, hours + 1),
+                    100, rng.randrange(0, hours + 1), 100, rng.randrange(0, hours + 1), image_id))
+
+            for filament in filaments:
+                self._write(writers, 'filaments', (
+                    filament['FilamentId'], user_id, filament['UserFilamentId'],
+                    rng.choice(MATERIALS), rng.choice(BRANDS), filament['ColorFamilyId'],
+                    filament['HtmlColor'], filament['LengthRemain'], filament['DateAcquired'],
+                    rng.choice(FILAMENT_SOURCES)))
+
+
+def bulk_load(engine, paths, reset=False):
+    """LOAD DATA LOCAL INFILE each CSV into its table, in foreign key order."""
+    conn = engine.connect()
+    try:
+        if not reset:
+            for table, _ in TABLE_COLUMNS:
+                if conn.execute('SELECT 1 FROM {0} LIMIT 1'.format(table)).first() is not None:
+                    raise RuntimeError('Table {0} is not empty. Generated ids start at 1, '
+                                       'rerun with --reset to replace the data.'.format(table))
+
+        conn.execute('SET FOREIGN_KEY_CHECKS = 0')
+        conn.execute('SET UNIQUE_CHECKS = 0')
+        if reset:
+            for table in DEPENDENT_TABLES:
+                if conn.execute("SHOW TABLES LIKE '{0}'".format(table)).first() is not None:
+                    conn.execute('TRUNCATE TABLE {0}'.format(table))
+            for table, _ in reversed(TABLE_COLUMNS):
+                conn.execute('TRUNCATE TABLE {0}'.format(table))
+
+        for table, columns in TABLE_COLUMNS:
+            bits = BIT_COLUMNS.get(table, [])
+            targets = ['@' + c if c in bits else c for c in columns]
+            casts = ', '.join('{0} = CAST(@{0} AS UNSIGNED)'.format(c) for c in bits)
+
+            started = time.time()
+            conn.execute(
+                "LOAD DATA LOCAL INFILE '{0}' INTO TABLE {1} "
+                "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+                "LINES TERMINATED BY '\\n' ({2}){3}".format(
+                    paths[table].replace('\\', '/'), table, ', '.join(targets),
+                    ' SET ' + casts if casts else ''))
+            print('loaded {0:<14} in {1:.1f}s'.format(table, time.time() - started))
+    finally:
+        conn.execute('SET UNIQUE_CHECKS = 1')
+        conn.execute('SET FOREIGN_KEY_CHECKS = 1')
+        conn.close()
+
+
+def get_engine():
+    from sqlalchemy import create_engine
+    from printapp_sqlalchemy.printapp_sqlalchemy import connectionUri
+
+    # LOAD DATA LOCAL needs to be enabled on the client side as well.
+    return create_engine(connectionUri, connect_args={'local_infile': 1})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate and bulk load a synthetic print3d dataset.')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--users', type=int, help='Overrides the user count of --scale.')
+    parser.add_argument('--prints', type=int, help='Overrides the print count of --scale.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--printers-per-user', type=float, default=2.0)
+    parser.add_argument('--filaments-per-user', type=float, default=6.0)
+    parser.add_argument('--csv-dir', help='Keep the generated CSVs here instead of a temp dir.')
+    parser.add_argument('--no-load', action='store_true', help='Only write the CSVs.')
+    parser.add_argument('--reset', action='store_true',
+                        help='Truncate all tables, including the job outbox, before loading. '
+                             'Destroys existing data.')
+    args = parser.parse_args()
+
+    users, prints = SCALES[args.scale]
+    users = args.users or users
+    prints = args.prints if args.prints is not None else prints
+
+    out_dir = args.csv_dir or tempfile.mkdtemp(prefix='print3d-seed-')
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    generator = DataGenerator(users, prints, seed=args.seed,
+                              printers_per_user=args.printers_per_user,
+                              filaments_per_user=args.filaments_per_user)
+    started = time.time()
+    paths = generator.write_csvs(out_dir)
+    print('generated {0} in {1:.1f}s -> {2}'.format(
+        ', '.join('{0} {1}'.format(generator.counts[t], t) for t, _ in TABLE_COLUMNS),
+        time.time() - started, out_dir))
+
+    try:
+        if not args.no_load:
+            bulk_load(get_engine(), paths, reset=args.reset)
+    finally:
+        if not args.csv_dir:
+            shutil.rmtree(out_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,502 @@
+"""Latency and throughput benchmark for the routes in app/main.py.
+
+Every route is exercised through the Flask test client and over real HTTP
+against a werkzeug server on localhost, backed by the database configured in
+printapp_sqlalchemy_config (load it with benchmark.generate_data first). S3
+and Auth0 are replaced with the stand-ins in benchmark/stubs.py.
+
+Reports p50/p95/p99 latency, throughput and SQL queries per request, and can
+save the results as a named baseline or compare against one:
+
+    python -m benchmark.run_benchmark --reset-data --scale large --save-baseline before
+    python -m benchmark.run_benchmark --reset-data --scale large --compare before --tolerance 0.15
+    python -m benchmark.run_benchmark --mode http --concurrency 8 --read-only
+
+The write scenarios change the data they run against, so saving or comparing
+a baseline with them needs --reset-data, which reloads a freshly generated
+dataset before each mode. Baselines record a fingerprint of the dataset and a
+comparison against a different one is refused.
+"""
+from __future__ import print_function, division
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import benchmark
+from benchmark import stubs
+from benchmark.generate_data import DEPENDENT_TABLES, SCALES, TABLE_COLUMNS, DataGenerator, bulk_load, get_engine
+
+BASELINE_DIR = os.path.join(benchmark.ROOT_DIR, 'benchmark', 'baselines')
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class QueryCounter(object):
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        with self._lock:
+            self.count += 1
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+
+
+class Fixtures(object):
+    """Picks random ids from the loaded dataset for the request builders."""
+
+    def __init__(self, db, seed):
+        from printapp_sqlalchemy.printapp_sqlalchemy import User, Printer, Filament, Print
+
+        self.db = db
+        self.rng = random.Random(seed)
+        self.prints = Print.__table__
+        self.created_prints = []
+
+        self.ranges = {}
+        for name, column in (('user', User.UserId), ('printer', Printer.PrinterId),
+                             ('filament', Filament.FilamentId), ('print', Print.PrintId)):
+            low, high = db.session.query(db.func.min(column), db.func.max(column)).one()
+            if low is None:
+                raise RuntimeError('No {0}s in the database, run benchmark.generate_data first.'.format(name))
+            self.ranges[name] = (low, high)
+
+    def random_id(self, name):
+        return self.rng.randint(*self.ranges[name])
+
+    def random_print(self):
+        """An existing print row, for routes that must keep its printer and filament."""
+        for _ in range(20):
+            row = self.db.session.execute(
+                self.prints.select().where(self.prints.c.PrintId == self.random_id('print'))).first()
+            if row is not None and row.PrinterId is not None and row.FilamentId is not None:
+                return row
+        raise RuntimeError('Could not find a print with a printer and filament.')
+
+    def random_date(self):
+        return '2017-{0:02d}-{1:02d}'.format(self.rng.randint(1, 12), self.rng.randint(1, 28))
+
+
+class Scenario(object):
+
+    def __init__(self, name, method, build, writes=False, on_response=None):
+        self.name = name
+        self.method = method
+        self.build = build
+        self.writes = writes
+        self.on_response = on_response
+
+
+def _filament_update(fx):
+    body = dict.fromkeys(['Brand', 'Material', 'ColorId', 'FilamentSource', 'DateAcquired', 'HtmlColor'])
+    body['LengthRemain'] = fx.rng.randint(50, 400)
+    return '/filaments/filamentdetails/{0}'.format(fx.random_id('filament')), body
+
+
+def _filament_create(fx):
+    return '/filaments/create', {
+        'UserId': fx.random_id('user'), 'Brand': 'Hatchbox', 'Material': 'PLA',
+        'LengthRemain': 330, 'ColorId': fx.rng.randint(1, 8), 'DateAcquired': fx.random_date(),
+        'FilamentSource': 'Amazon', 'HtmlColor': '#000000'
+    }
+
+
+def _printer_update(fx):
+    return '/printers/printerdetails/{0}'.format(fx.random_id('printer')), {
+        'PrinterName': 'Prusa i3 MK2', 'DateAcquired': fx.random_date(), 'PrinterSource': 'Amazon',
+        'BeltMaintInt': 100, 'WireMaintInt': 100, 'LubeMaintInt': 100
+    }
+
+
+def _printer_create(fx):
+    return '/printers/create', {
+        'UserId': fx.random_id('user'), 'PrinterName': 'Wanhao D7', 'DateAcquired': fx.random_date(),
+        'PrinterSource': 'Newegg', 'BeltMaintInt': 100, 'WireMaintInt': 100, 'LubeMaintInt': 100
+    }
+
+
+def _print_body(fx, row):
+    return {
+        'PrintName': '3D Benchy', 'PrintDate': fx.random_date(), 'SourceUrl': None, 'Success': True,
+        'PrintTimeMinutes': fx.rng.randint(10, 600), 'LengthUsed': fx.rng.randint(1, 20),
+        'FilamentId': row.FilamentId, 'PrinterId': row.PrinterId
+    }
+
+
+def _print_update(fx):
+    row = fx.random_print()
+    return '/prints/printdetails/{0}'.format(row.PrintId), _print_body(fx, row)
+
+
+def _print_create(fx):
+    row = fx.random_print()
+    body = _print_body(fx, row)
+    body['UserId'] = row.UserId
+    return '/prints/create', body
+
+
+def _print_created(fx, data):
+    fx.created_prints.append(json.loads(data)['data']['PrintId'])
+
+
+def _print_delete(fx):
+    # Only delete prints the print_create scenario made earlier in this run.
+    if not fx.created_prints:
+        return None
+    return '/prints/printdetails/{0}'.format(fx.created_prints.pop()), None
+
+
+def _image_update(fx):
+    return '/images/imagerequest', {
+        'PrintId': fx.random_id('print'), 'PrinterId': None,
+        'ImageUrl': stubs.BUCKET_URL + 'bench{0:08d}'.format(fx.rng.randint(0, 99999999))
+    }
+
+
+def _user_create(fx):
+    return '/users/create', {'auth0UserId': 'auth0|bench-{0:016x}'.format(fx.rng.getrandbits(64))}
+
+
+SCENARIOS = [
+    Scenario('filament_detail', 'GET',
+             lambda fx: ('/filaments/filamentdetails/{0}'.format(fx.random_id('filament')), None)),
+    Scenario('filament_library', 'GET', lambda fx: ('/filaments/{0}'.format(fx.random_id('user')), None)),
+    Scenario('filament_colors', 'GET', lambda fx: ('/filaments/colors', None)),
+    Scenario('printer_library', 'GET', lambda fx: ('/printers/{0}'.format(fx.random_id('user')), None)),
+    Scenario('printer_detail', 'GET',
+             lambda fx: ('/printers/printerdetails/{0}'.format(fx.random_id('printer')), None)),
+    Scenario('print_library', 'GET', lambda fx: ('/prints/{0}'.format(fx.random_id('user')), None)),
+    Scenario('print_detail', 'GET',
+             lambda fx: ('/prints/printdetails/{0}'.format(fx.random_id('print')), None)),
+    Scenario('image_presign', 'GET', lambda fx: ('/images/imagerequest', None)),
+    Scenario('job_metrics', 'GET', lambda fx: ('/jobs/metrics', None)),
+    Scenario('filament_update', 'PUT', _filament_update, writes=True),
+    Scenario('filament_create', 'POST', _filament_create, writes=True),
+    Scenario('printer_update', 'PUT', _printer_update, writes=True),
+    Scenario('printer_create', 'POST', _printer_create, writes=True),
+    Scenario('printer_maintenance', 'PUT',
+             lambda fx: ('/printers/maintenance/wire/{0}'.format(fx.random_id('printer')), None), writes=True),
+    Scenario('print_update', 'PUT', _print_update, writes=True),
+    Scenario('print_create', 'POST', _print_create, writes=True, on_response=_print_created),
+    Scenario('print_delete', 'DELETE', _print_delete, writes=True),
+    Scenario('image_update', 'PUT', _image_update, writes=True),
+    Scenario('user_create', 'POST', _user_create, writes=True),
+]
+
+
+class ClientTransport(object):
+    name = 'client'
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def call(self, method, path, headers, body):
+        resp = self.client.open(path, method=method, headers=headers, data=body)
+        return resp.status_code, resp.data
+
+    def close(self):
+        pass
+
+
+class HttpTransport(object):
+    name = 'http'
+
+    def __init__(self, app):
+        import requests
+        from werkzeug.serving import make_server
+
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.base_url = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.local = threading.local()
+        self.requests = requests
+
+    def call(self, method, path, headers, body):
+        # One keep-alive session per client thread.
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = self.requests.Session()
+        resp = session.request(method, self.base_url + path, headers=headers, data=body)
+        return resp.status_code, resp.content
+
+    def close(self):
+        self.server.shutdown()
+        self.thread.join()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = int(round(pct / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def run_scenario(scenario, transport, app, fixtures, counter, headers, n_requests, warmup, concurrency):
+    with app.app_context():
+        calls = []
+        for _ in range(warmup + n_requests):
+            built = scenario.build(fixtures)
+            if built is not None:
+                path, body = built
+                calls.append((path, json.dumps(body) if body is not None else None))
+        fixtures.db.session.remove()
+
+    for path, body in calls[:warmup]:
+        transport.call(scenario.method, path, headers, body)
+    calls = calls[warmup:]
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker(chunk):
+        for path, body in chunk:
+            started = timer()
+            status, data = transport.call(scenario.method, path, headers, body)
+            elapsed = timer() - started
+            if scenario.on_response is not None and status == 200:
+                scenario.on_response(fixtures, data)
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    counter.reset()
+    started = timer()
+    if concurrency > 1:
+        threads = [threading.Thread(target=worker, args=(calls[i::concurrency],)) for i in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    else:
+        worker(calls)
+    wall = timer() - started
+
+    latencies.sort()
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': sum(n for status, n in statuses.items() if status >= 500),
+        'statuses': dict((str(k), v) for k, v in statuses.items()),
+        'p50_ms': percentile(latencies, 50) * 1000 if count else None,
+        'p95_ms': percentile(latencies, 95) * 1000 if count else None,
+        'p99_ms': percentile(latencies, 99) * 1000 if count else None,
+        'throughput_rps': count / wall if wall > 0 else None,
+        'queries_per_request': counter.count / count if count else None,
+    }
+
+
+def _fmt(value, spec='{0:.2f}'):
+    return '-' if value is None else spec.format(value)
+
+
+def print_results(mode, results):
+    print('\n[{0}]'.format(mode))
+    print('{0:<20} {1:>6} {2:>6} {3:>9} {4:>9} {5:>9} {6:>10} {7:>8}'.format(
+        'scenario', 'reqs', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries'))
+    for name, r in results.items():
+        print('{0:<20} {1:>6} {2:>6} {3:>9} {4:>9} {5:>9} {6:>10} {7:>8}'.format(
+            name, r['requests'], r['errors'], _fmt(r['p50_ms']), _fmt(r['p95_ms']), _fmt(r['p99_ms']),
+            _fmt(r['throughput_rps'], '{0:.1f}'), _fmt(r['queries_per_request'])))
+
+
+def dataset_fingerprint(engine):
+    """Row count and content checksum of every table the benchmark reads or writes."""
+    fingerprint = {}
+    with engine.connect() as conn:
+        for table, columns in TABLE_COLUMNS:
+            rows, checksum = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(CRC32(CONCAT_WS(',', {0}))), 0) FROM {1}".format(
+                    ', '.join(columns), table)).first()
+            fingerprint[table] = '{0}:{1}'.format(rows, int(checksum))
+        for table in DEPENDENT_TABLES:
+            if conn.execute("SHOW TABLES LIKE '{0}'".format(table)).first() is not None:
+                fingerprint[table] = str(conn.execute('SELECT COUNT(*) FROM ' + table).scalar())
+    return fingerprint
+
+
+def status_mix(statuses):
+    total = sum(statuses.values())
+    return dict((status, round(n / total, 4)) for status, n in statuses.items()) if total else {}
+
+
+def compare(current, baseline, tolerance):
+    """Print deltas against a saved baseline and return the list of regressions.
+
+    Besides p95 and throughput beyond the tolerance, any extra queries, any
+    rise in 5xx errors and any change in the share of each status code count.
+    """
+    regressions = []
+    print('\nCompared to baseline {0!r} ({1}), tolerance {2:.0%}:'.format(
+        baseline['name'], baseline['created'], tolerance))
+    for mode, results in current['results'].items():
+        for name, r in results.items():
+            base = baseline['results'].get(mode, {}).get(name)
+            if base is None or not r['requests'] or not base['requests']:
+                continue
+
+            problems = []
+            if r['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+                problems.append('p95')
+            if r['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+                problems.append('throughput')
+            if r['queries_per_request'] > base['queries_per_request'] + 0.01:
+                problems.append('queries')
+            if r['errors'] > base['errors']:
+                problems.append('errors {0} -> {1}'.format(base['errors'], r['errors']))
+            if status_mix(r['statuses']) != status_mix(base['statuses']):
+                problems.append('statuses {0} -> {1}'.format(
+                    json.dumps(base['statuses'], sort_keys=True), json.dumps(r['statuses'], sort_keys=True)))
+            if problems:
+                regressions.append((mode, name, problems))
+
+            print('  {0:<6} {1:<20} p95 {2:+7.1%}  req/s {3:+7.1%}  queries {4:+.2f}  {5}'.format(
+                mode, name, r['p95_ms'] / base['p95_ms'] - 1,
+                r['throughput_rps'] / base['throughput_rps'] - 1,
+                r['queries_per_request'] - base['queries_per_request'],
+                'REGRESSION: ' + ', '.join(problems) if problems else ''))
+    return regressions
+
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, name + '.json')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the print3d API routes.')
+    parser.add_argument('--mode', choices=['client', 'http', 'both'], default='both')
+    parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario.')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--scenarios', help='Comma separated subset of: ' + ', '.join(s.name for s in SCENARIOS))
+    parser.add_argument('--read-only', action='store_true', help='Skip scenarios that write to the database.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--rate-limit', action='store_true',
+                        help='Keep the configured API key rate limiter on. Off by default so it does not throttle the run.')
+    parser.add_argument('--save-baseline', metavar='NAME')
+    parser.add_argument('--compare', metavar='NAME')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed relative p95/throughput change before flagging a regression.')
+    parser.add_argument('--reset-data', action='store_true',
+                        help='Replace the database with a generated dataset before each mode. '
+                             'Destroys existing data.')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small',
+                        help='Dataset size for --reset-data.')
+    parser.add_argument('--users', type=int, help='Overrides the user count of --scale.')
+    parser.add_argument('--prints', type=int, help='Overrides the print count of --scale.')
+    parser.add_argument('--data-seed', type=int, default=42, help='Seed of the --reset-data dataset.')
+    args = parser.parse_args()
+
+    scenarios = SCENARIOS
+    if args.scenarios:
+        wanted = args.scenarios.split(',')
+        scenarios = [s for s in SCENARIOS if s.name in wanted]
+    if args.read_only:
+        scenarios = [s for s in scenarios if not s.writes]
+    if (args.save_baseline or args.compare) and not args.reset_data and any(s.writes for s in scenarios):
+        parser.error('write scenarios change the data, use --reset-data or --read-only with '
+                     '--save-baseline and --compare')
+
+    stubs.install()
+    from main import app, db
+    from configs.allowedkeys import Allowed_Keys
+    from rate_limiter.rate_limiter import set_limiter
+
+    if not args.rate_limit:
+        set_limiter(None)
+
+    baseline = None
+    if args.compare:
+        with open(baseline_path(args.compare)) as f:
+            baseline = json.load(f)
+
+    data_paths = None
+    data_dir = tempfile.mkdtemp(prefix='print3d-bench-') if args.reset_data else None
+    try:
+        if args.reset_data:
+            users, prints = SCALES[args.scale]
+            generator = DataGenerator(args.users or users, args.prints if args.prints is not None else prints,
+                                      seed=args.data_seed)
+            data_paths = generator.write_csvs(data_dir)
+            bulk_load(get_engine(), data_paths, reset=True)
+
+        dataset = dataset_fingerprint(db.engine)
+        if baseline is not None and baseline.get('dataset') != dataset:
+            print('Baseline {0!r} was taken against a different dataset, regenerate it with the same '
+                  '--reset-data options first.\n  baseline: {1}\n  current:  {2}'.format(
+                      args.compare, json.dumps(baseline.get('dataset'), sort_keys=True),
+                      json.dumps(dataset, sort_keys=True)))
+            sys.exit(2)
+
+        headers = {'ApiKey': Allowed_Keys[0], 'Content-Type': 'application/json'}
+        counter = QueryCounter(db.engine)
+
+        report = {
+            'created': datetime.utcnow().isoformat(),
+            'config': {'requests': args.requests, 'warmup': args.warmup,
+                       'concurrency': args.concurrency, 'seed': args.seed},
+            'dataset': dataset,
+            'results': {},
+        }
+
+        modes = [ClientTransport, HttpTransport] if args.mode == 'both' else \
+            [ClientTransport if args.mode == 'client' else HttpTransport]
+        for i, transport_class in enumerate(modes):
+            # Every mode starts from the same data, and picks the same ids.
+            if args.reset_data and i > 0:
+                bulk_load(get_engine(), data_paths, reset=True)
+            with app.app_context():
+                fixtures = Fixtures(db, args.seed)
+
+            transport = transport_class(app)
+            results = report['results'][transport.name] = OrderedDict()
+            try:
+                for scenario in scenarios:
+                    results[scenario.name] = run_scenario(scenario, transport, app, fixtures, counter, headers,
+                                                          args.requests, args.warmup, args.concurrency)
+            finally:
+                transport.close()
+            print_results(transport.name, results)
+    finally:
+        if data_dir is not None:
+            shutil.rmtree(data_dir)
+
+    regressions = []
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+
+    if args.save_baseline:
+        if not os.path.isdir(BASELINE_DIR):
+            os.makedirs(BASELINE_DIR)
+        report['name'] = args.save_baseline
+        with open(baseline_path(args.save_baseline), 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print('\nSaved baseline to ' + baseline_path(args.save_baseline))
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
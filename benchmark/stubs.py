@@ -0,0 +1,58 @@
+"""Local stand-ins for the S3 and Auth0 clients.
+
+install() has to run before main is imported: it registers these classes
+under the module names main.py imports from, so the real boto3 and Auth0
+clients (and their config modules) are never loaded.
+"""
+import sys
+import types
+from string import ascii_lowercase, ascii_uppercase
+from random import choice
+
+BUCKET_URL = 'https://print3d-images.s3.amazonaws.com/'
+
+
+class StubImageHandler(object):
+    deleted_keys = []
+
+    def get_presigned_post(self):
+        file_key = ''.join([choice(ascii_uppercase + ascii_lowercase) for x in range(8)])
+        return {
+            'url': BUCKET_URL,
+            'fields': {
+                'key': file_key,
+                'x-amz-acl': 'public-read',
+                'policy': 'stub-policy',
+                'x-amz-signature': 'stub-signature'
+            }
+        }
+
+    def check_file_exists(self, file_key):
+        return True
+
+    def delete_file_by_key(self, file_key):
+        self.deleted_keys.append(file_key)
+        return {'Deleted': [{'Key': file_key}]}
+
+
+class StubAuth0UserManager(object):
+    authToken = None
+    app_metadata = {}
+
+    def get_bearer(self):
+        self.authToken = 'stub-token'
+
+    def set_app_metadata(self, auth0_user_id, user_id):
+        self.app_metadata[auth0_user_id] = {'app_user_id': user_id}
+        return {'user_id': auth0_user_id, 'app_metadata': {'app_user_id': user_id}}
+
+
+def _register(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+
+
+def install():
+    _register('image_handler.image_handler', ImageHandler=StubImageHandler)
+    _register('auth0.auth0_custom', Auth0UserManager=StubAuth0UserManager)
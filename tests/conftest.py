@@ -0,0 +1,142 @@
+import os
+import sys
+import types
+
+import pytest
+
+# The app modules import each other the way app/run.py does, with app/ on the path.
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (os.path.join(ROOT_DIR, 'app'), ROOT_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.automap import automap_base
+
+from benchmark import stubs
+
+# SQLite versions of the tables in SQL/Initialize.
+SCHEMA = [
+    """CREATE TABLE users (
+        UserId INTEGER PRIMARY KEY AUTOINCREMENT,
+        UserName VARCHAR(50),
+        Auth0UserId VARCHAR(100) UNIQUE)""",
+    """CREATE TABLE images (
+        ImageId INTEGER PRIMARY KEY AUTOINCREMENT,
+        ImagePath VARCHAR(255))""",
+    """CREATE TABLE colorfamilies (
+        ColorFamilyId INTEGER PRIMARY KEY AUTOINCREMENT,
+        ColorFamilyName VARCHAR(15))""",
+    """CREATE TABLE printers (
+        PrinterId INTEGER PRIMARY KEY AUTOINCREMENT,
+        UserPrinterId INTEGER, UserId INTEGER REFERENCES users(UserId),
+        PrinterName VARCHAR(50), DateAcquired DATE, NumberOfPrints INTEGER, PrintTimeHours INTEGER,
+        PrinterSource VARCHAR(255), BeltMaintInt INTEGER, BeltMaintLast INTEGER,
+        WireMaintInt INTEGER, WireMaintLast INTEGER, LubeMaintInt INTEGER, LubeMaintLast INTEGER,
+        MainPrinterImageId INTEGER REFERENCES images(ImageId))""",
+    """CREATE TABLE filaments (
+        FilamentId INTEGER PRIMARY KEY AUTOINCREMENT,
+        UserId INTEGER REFERENCES users(UserId), UserFilamentId INTEGER,
+        Material VARCHAR(50), Brand VARCHAR(20),
+        ColorFamilyId INTEGER REFERENCES colorfamilies(ColorFamilyId),
+        HtmlColor VARCHAR(20), LengthRemain INTEGER, DateAcquired DATE, FilamentSource VARCHAR(50))""",
+    """CREATE TABLE prints (
+        PrintId INTEGER PRIMARY KEY AUTOINCREMENT,
+        UserId INTEGER REFERENCES users(UserId),
+        PrinterId INTEGER REFERENCES printers(PrinterId),
+        FilamentId INTEGER REFERENCES filaments(FilamentId),
+        MainPrintImageId INTEGER REFERENCES images(ImageId),
+        PrintName VARCHAR(50), SourceUrl VARCHAR(255), Success INTEGER, PrintTimeHours INTEGER,
+        PrintTimeMinutes INTEGER, PrintDate DATE, ModelFileUrl VARCHAR(255), LengthUsed INTEGER)""",
+    """CREATE TABLE outbox (
+        JobId INTEGER PRIMARY KEY AUTOINCREMENT,
+        JobType VARCHAR(50) NOT NULL,
+        IdempotencyKey VARCHAR(191) NOT NULL UNIQUE,
+        Payload TEXT,
+        Status VARCHAR(10) NOT NULL DEFAULT 'pending',
+        Attempts INTEGER NOT NULL DEFAULT 0,
+        LastError TEXT,
+        CreatedAt DATETIME NOT NULL,
+        AvailableAt DATETIME NOT NULL,
+        LockedBy VARCHAR(64),
+        LockedAt DATETIME,
+        CompletedAt DATETIME)""",
+]
+
+TABLES = ['outbox', 'prints', 'filaments', 'printers', 'colorfamilies', 'images', 'users']
+
+
+def _no_pysqlite_transactions(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+def _begin(conn):
+    conn.execute('BEGIN')
+
+
+def sqlite_savepoints(engine):
+    """Let SQLAlchemy issue BEGIN itself, so savepoints work as on MySQL.
+
+    pysqlite otherwise starts transactions on its own and breaks begin_nested().
+    """
+    if not event.contains(engine, 'begin', _begin):
+        event.listen(engine, 'connect', _no_pysqlite_transactions)
+        event.listen(engine, 'begin', _begin)
+
+
+@pytest.fixture(scope='session')
+def database(tmpdir_factory):
+    """A SQLite database standing in for MySQL, registered as printapp_sqlalchemy.
+
+    S3 and Auth0 are replaced with the stand-ins from benchmark/stubs.py, so
+    nothing here talks to a real service.
+    """
+    uri = 'sqlite:///' + str(tmpdir_factory.mktemp('db').join('printapp.sqlite'))
+    engine = create_engine(uri)
+    sqlite_savepoints(engine)
+    for statement in SCHEMA:
+        engine.execute(statement)
+
+    Base = automap_base()
+    Base.prepare(engine, reflect=True)
+
+    models = types.ModuleType('printapp_sqlalchemy.printapp_sqlalchemy')
+    models.__dict__.update(
+        connectionUri=uri, engine=engine, Base=Base,
+        User=Base.classes.users, Print=Base.classes.prints, Printer=Base.classes.printers,
+        Filament=Base.classes.filaments, Image=Base.classes.images,
+        ColorFamily=Base.classes.colorfamilies)
+    sys.modules['printapp_sqlalchemy.printapp_sqlalchemy'] = models
+
+    stubs.install()
+    return engine
+
+
+@pytest.fixture
+def engine(database):
+    yield database
+
+    for table in TABLES:
+        database.execute('DELETE FROM ' + table)
+    del stubs.StubImageHandler.deleted_keys[:]
+    stubs.StubAuth0UserManager.app_metadata.clear()
+
+
+@pytest.fixture
+def main(engine):
+    import main
+    from rate_limiter.rate_limiter import set_limiter
+
+    set_limiter(None)
+    sqlite_savepoints(main.db.engine)
+    return main
+
+
+@pytest.fixture
+def commits(main):
+    """Counts the commits the app's engine makes."""
+    count = []
+    listener = lambda conn: count.append(1)
+    event.listen(main.db.engine, 'commit', listener)
+    yield count
+    event.remove(main.db.engine, 'commit', listener)
@@ -0,0 +1,247 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.orm import Session
+
+from benchmark.stubs import StubImageHandler, StubAuth0UserManager
+from configs.allowedkeys import Allowed_Keys
+
+HEADERS = {'ApiKey': Allowed_Keys[0], 'Content-Type': 'application/json'}
+
+
+def outbox_rows(engine):
+    from jobs.outbox import outbox_class
+
+    Outbox = outbox_class()
+    session = Session(bind=engine)
+    try:
+        return session.query(Outbox).order_by(Outbox.JobId).all()
+    finally:
+        session.close()
+
+
+def add_job(engine, **columns):
+    from jobs.outbox import outbox_class
+
+    now = datetime.utcnow()
+    values = dict(JobType='delete_s3_image', Payload=json.dumps({'FileKey': 'abc'}), Status='pending',
+                  Attempts=0, CreatedAt=now, AvailableAt=now)
+    values.update(columns)
+    values.setdefault('IdempotencyKey', 'test:{0}'.format(len(outbox_rows(engine))))
+
+    session = Session(bind=engine)
+    session.add(outbox_class()(**values))
+    session.commit()
+
+
+def put_image(main, url):
+    return main.app.test_client().put('/images/imagerequest', headers=HEADERS, data=json.dumps(
+        {'PrintId': 1, 'PrinterId': None, 'ImageUrl': url}))
+
+
+def test_image_update_queues_s3_delete_in_one_commit(main, engine, commits):
+    engine.execute("INSERT INTO images (ImageId, ImagePath) VALUES (1, 'https://bucket/OldKey')")
+    engine.execute("INSERT INTO prints (PrintId, PrintName, MainPrintImageId) VALUES (1, 'Benchy', 1)")
+
+    resp = put_image(main, 'https://bucket/NewKey')
+
+    assert resp.status_code == 200
+    assert len(commits) == 1
+    assert engine.execute('SELECT ImagePath FROM images WHERE ImageId = 1').scalar() == 'https://bucket/NewKey'
+
+    jobs = outbox_rows(engine)
+    assert [(j.JobType, json.loads(j.Payload), j.Status) for j in jobs] == \
+        [('delete_s3_image', {'FileKey': 'OldKey'}, 'pending')]
+    assert StubImageHandler.deleted_keys == []
+
+
+def test_repeated_image_swaps_reuse_queued_jobs(main, engine):
+    engine.execute("INSERT INTO images (ImageId, ImagePath) VALUES (1, 'https://bucket/A')")
+    engine.execute("INSERT INTO prints (PrintId, PrintName, MainPrintImageId) VALUES (1, 'Benchy', 1)")
+
+    statuses = [put_image(main, 'https://bucket/' + key).status_code for key in ('B', 'A', 'B')]
+
+    assert statuses == [200, 200, 200]
+    assert [json.loads(j.Payload)['FileKey'] for j in outbox_rows(engine)] == ['A', 'B']
+
+
+def test_user_create_queues_auth0_update(main, engine):
+    client = main.app.test_client()
+    body = json.dumps({'auth0UserId': 'auth0|abc'})
+
+    first = json.loads(client.post('/users/create', headers=HEADERS, data=body).data)
+    retried = json.loads(client.post('/users/create', headers=HEADERS, data=body).data)
+
+    user_id = first['data']['app_metadata']['app_user_id']
+    assert retried['data']['app_metadata']['app_user_id'] == user_id
+    assert StubAuth0UserManager.app_metadata == {}
+
+    jobs = outbox_rows(engine)
+    assert [(j.JobType, json.loads(j.Payload)) for j in jobs] == \
+        [('set_auth0_app_metadata', {'Auth0UserId': 'auth0|abc', 'UserId': user_id})]
+
+
+def test_process_batch_runs_handler_and_marks_done(main, engine):
+    from jobs.handlers import JOB_HANDLERS
+    from jobs.worker import process_batch
+
+    add_job(engine, JobType='delete_s3_image', Payload=json.dumps({'FileKey': 'OldKey'}))
+    add_job(engine, JobType='set_auth0_app_metadata', Payload=json.dumps({'Auth0UserId': 'auth0|abc', 'UserId': 7}))
+
+    with engine.connect() as conn:
+        assert process_batch(conn, JOB_HANDLERS, 'test', 10, 300, 3) == 2
+
+    assert StubImageHandler.deleted_keys == ['OldKey']
+    assert StubAuth0UserManager.app_metadata == {'auth0|abc': {'app_user_id': 7}}
+    assert [(j.Status, j.Attempts, j.LockedBy) for j in outbox_rows(engine)] == [('done', 1, None)] * 2
+    assert all(j.CompletedAt is not None for j in outbox_rows(engine))
+
+
+def test_failing_job_is_retried_then_failed(main, engine):
+    from jobs.worker import process_batch
+
+    def boom(payload, idempotency_key):
+        raise IOError('S3 is down')
+
+    add_job(engine, JobType='boom')
+
+    with engine.connect() as conn:
+        process_batch(conn, {'boom': boom}, 'test', 10, 300, 2)
+        job = outbox_rows(engine)[0]
+        assert (job.Status, job.Attempts) == ('pending', 1)
+        assert job.AvailableAt > datetime.utcnow()
+        assert 'S3 is down' in job.LastError
+
+        # Not due yet, so nothing is claimed.
+        assert process_batch(conn, {'boom': boom}, 'test', 10, 300, 2) == 0
+
+        conn.execute('UPDATE outbox SET AvailableAt = ?', datetime.utcnow() - timedelta(seconds=1))
+        process_batch(conn, {'boom': boom}, 'test', 10, 300, 2)
+
+    job = outbox_rows(engine)[0]
+    assert (job.Status, job.Attempts) == ('failed', 2)
+
+
+def test_expired_lease_is_claimed_again(main, engine):
+    from jobs.outbox import claim
+
+    now = datetime.utcnow()
+    add_job(engine, IdempotencyKey='expired', Status='running', Attempts=1, LockedBy='dead', LockedAt=now - timedelta(hours=1))
+    add_job(engine, IdempotencyKey='held', Status='running', Attempts=1, LockedBy='alive', LockedAt=now)
+    add_job(engine, IdempotencyKey='exhausted', Status='running', Attempts=3, LockedBy='dead',
+            LockedAt=now - timedelta(hours=1))
+
+    with engine.connect() as conn:
+        claimed = claim(conn, 'new-token', 10, 60, 3)
+
+    assert [(j.IdempotencyKey, j.Attempts) for j in claimed] == [('expired', 2)]
+    assert [(j.IdempotencyKey, j.Status, j.LockedBy) for j in outbox_rows(engine)] == [
+        ('expired', 'running', 'new-token'), ('held', 'running', 'alive'), ('exhausted', 'failed', None)]
+
+
+def test_queue_metrics(main, engine):
+    from jobs.outbox import queue_metrics
+
+    now = datetime.utcnow()
+    add_job(engine, CreatedAt=now - timedelta(seconds=600), AvailableAt=now - timedelta(seconds=120))
+    add_job(engine)
+    # Waiting out its backoff, so it doesn't count as lag however old it is.
+    add_job(engine, Attempts=2, CreatedAt=now - timedelta(hours=1), AvailableAt=now + timedelta(seconds=60))
+    add_job(engine, Status='running', LockedBy='worker', LockedAt=now, AvailableAt=now - timedelta(seconds=600))
+    add_job(engine, Status='failed', AvailableAt=now - timedelta(seconds=900))
+    add_job(engine, Status='done', AvailableAt=now - timedelta(seconds=900))
+
+    with engine.connect() as conn:
+        metrics = queue_metrics(conn)
+
+    assert dict((k, metrics[k]) for k in ('pending', 'due', 'retrying', 'running', 'failed', 'depth')) == \
+        {'pending': 3, 'due': 2, 'retrying': 1, 'running': 1, 'failed': 1, 'depth': 4}
+    assert 120 <= metrics['lag_seconds'] < 130
+
+
+def test_enqueue_ignores_a_repeated_key(main, engine):
+    from jobs.outbox import enqueue
+
+    session = Session(bind=engine)
+    first = enqueue(session, 'delete_s3_image', {'FileKey': 'a'}, 'delete_s3_image:1:a')
+    second = enqueue(session, 'delete_s3_image', {'FileKey': 'a'}, 'delete_s3_image:1:a')
+    session.commit()
+
+    assert first is second
+    assert len(outbox_rows(engine)) == 1
+
+
+def test_enqueue_requeues_a_failed_key(main, engine):
+    from jobs.outbox import enqueue
+
+    add_job(engine, IdempotencyKey='delete_s3_image:1:a', Status='failed', Attempts=8,
+            AvailableAt=datetime.utcnow() + timedelta(seconds=300))
+
+    session = Session(bind=engine)
+    enqueue(session, 'delete_s3_image', {'FileKey': 'a'}, 'delete_s3_image:1:a')
+    session.commit()
+
+    jobs = outbox_rows(engine)
+    assert [(j.Status, j.Attempts, json.loads(j.Payload)) for j in jobs] == [('pending', 0, {'FileKey': 'a'})]
+    assert jobs[0].AvailableAt <= datetime.utcnow()
+
+
+def test_enqueue_survives_a_concurrent_insert(main, engine, monkeypatch):
+    from jobs import outbox
+
+    add_job(engine, IdempotencyKey='delete_s3_image:1:a')
+    engine.execute("INSERT INTO images (ImageId, ImagePath) VALUES (1, 'https://bucket/A')")
+
+    # The other request's row isn't there yet when this one checks for it.
+    find_job = outbox._find_job
+    misses = []
+
+    def racing_find_job(session, idempotency_key, for_update=False):
+        if not misses:
+            misses.append(idempotency_key)
+            return None
+        return find_job(session, idempotency_key, for_update)
+    monkeypatch.setattr(outbox, '_find_job', racing_find_job)
+
+    session = Session(bind=engine)
+    session.execute("UPDATE images SET ImagePath = 'https://bucket/B' WHERE ImageId = 1")
+    job = outbox.enqueue(session, 'delete_s3_image', {'FileKey': 'a'}, 'delete_s3_image:1:a')
+    session.commit()
+
+    job_id = job.JobId
+    session.close()
+
+    assert misses == ['delete_s3_image:1:a']
+    assert job_id == outbox_rows(engine)[0].JobId
+    assert len(outbox_rows(engine)) == 1
+    # Only the savepoint was rolled back, not the rest of the transaction.
+    assert engine.execute('SELECT ImagePath FROM images WHERE ImageId = 1').scalar() == 'https://bucket/B'
+
+
+def test_s3_delete_errors_fail_the_job(main, engine, monkeypatch):
+    from jobs.handlers import delete_s3_image
+
+    monkeypatch.setattr(StubImageHandler, 'delete_file_by_key', lambda self, key: {
+        'Errors': [{'Key': key, 'Code': 'AccessDenied', 'Message': 'Access Denied'}]})
+
+    with pytest.raises(IOError) as error:
+        delete_s3_image({'FileKey': 'OldKey'}, 'delete_s3_image:1:OldKey')
+    assert 'AccessDenied' in str(error.value)
+
+
+def test_jobs_are_claimed_one_per_lease(main, engine):
+    from jobs.worker import process_batch
+
+    add_job(engine, JobType='check')
+    add_job(engine, JobType='check')
+    seen = []
+
+    def check(payload, idempotency_key):
+        seen.append([(j.Status, j.LockedBy is not None) for j in outbox_rows(engine)])
+
+    with engine.connect() as conn:
+        assert process_batch(conn, {'check': check}, 'test', 10, 300, 3) == 2
+
+    # The second job is still pending while the first one runs.
+    assert seen == [[('running', True), ('pending', False)], [('done', False), ('running', True)]]
@@ -0,0 +1,119 @@
+import pytest
+from flask import Flask
+
+from auth_decorators import required_apikey, rate_class
+from configs.allowedkeys import Allowed_Keys
+from rate_limiter.rate_limiter import RateLimiter, MemoryBackend, SqliteBackend, set_limiter
+
+LIMITS = {'read': (2, 1.0), 'write': (1, 1.0), 'presign': (1, 0.5)}
+
+
+class BrokenBackend(object):
+    def take(self, key, capacity, rate):
+        raise IOError('database is locked')
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+
+    @app.route('/read', methods=['GET', 'POST'])
+    @required_apikey
+    def read():
+        return 'ok'
+
+    @app.route('/presign')
+    @required_apikey
+    @rate_class('presign')
+    def presign():
+        return 'ok'
+
+    yield app.test_client()
+    set_limiter(None)
+
+
+def get(client, path, method='GET'):
+    return client.open(path, method=method, headers={'ApiKey': Allowed_Keys[0]})
+
+
+def test_refuses_after_burst_with_retry_after(client):
+    set_limiter(RateLimiter(MemoryBackend(), LIMITS))
+
+    assert [get(client, '/read').status_code for _ in range(3)] == [200, 200, 429]
+
+    get(client, '/presign')
+    resp = get(client, '/presign')
+    assert resp.status_code == 429
+    assert resp.headers['Retry-After'] == '2'
+
+
+def test_route_classes_have_separate_buckets(client):
+    set_limiter(RateLimiter(MemoryBackend(), LIMITS))
+
+    assert get(client, '/read', 'POST').status_code == 200
+    assert get(client, '/read', 'POST').status_code == 429
+    assert get(client, '/read').status_code == 200
+    assert get(client, '/presign').status_code == 200
+
+
+def test_backend_errors_let_requests_through(client):
+    set_limiter(RateLimiter(BrokenBackend(), LIMITS))
+
+    assert get(client, '/read').status_code == 200
+
+
+def test_sqlite_buckets_are_shared_between_connections(tmpdir):
+    path = str(tmpdir.join('buckets.sqlite'))
+    first = RateLimiter(SqliteBackend(path), LIMITS)
+    second = RateLimiter(SqliteBackend(path), LIMITS)
+
+    assert first.check('key', 'write') is None
+    assert second.check('key', 'write') > 0
+
+
+def test_key_overrides():
+    limiter = RateLimiter(MemoryBackend(), LIMITS, {'partner': {'write': (3, 1.0)}})
+
+    assert [limiter.check('partner', 'write') is None for _ in range(4)] == [True, True, True, False]
+    assert [limiter.check('other', 'write') is None for _ in range(2)] == [True, False]
+
+
+@pytest.mark.parametrize('limit', [(5, 0), (0, 1.0)])
+def test_invalid_limits_are_rejected(limit):
+    with pytest.raises(ValueError):
+        RateLimiter(MemoryBackend(), {'read': limit})
+
+
+def test_config_errors_are_logged_once(monkeypatch):
+    from rate_limiter import rate_limiter
+
+    calls = []
+
+    def broken_config():
+        calls.append(1)
+        raise ValueError('Unknown rate limit backend memcached')
+
+    monkeypatch.setattr(rate_limiter, 'limiter_from_config', broken_config)
+    set_limiter(rate_limiter._NOT_CONFIGURED)
+
+    assert rate_limiter.get_limiter() is None
+    assert rate_limiter.get_limiter() is None
+    assert calls == [1]
+
+
+def test_locked_sqlite_bucket_fails_fast(tmpdir):
+    import sqlite3
+    import time
+
+    path = str(tmpdir.join('buckets.sqlite'))
+    backend = SqliteBackend(path)
+    backend.take('key:read', 2, 1.0)
+
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute('BEGIN IMMEDIATE')
+    started = time.time()
+    with pytest.raises(sqlite3.OperationalError):
+        backend.take('key:read', 2, 1.0)
+    holder.execute('ROLLBACK')
+
+    assert time.time() - started < 0.5